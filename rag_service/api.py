@@ -4,16 +4,18 @@ from dotenv import load_dotenv
 load_dotenv()
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Optional, AsyncGenerator
+import os
 import json
 import asyncio
 try:
-    from .retriever import retrieve
+    from .retriever import retrieve, encode_query
     from .llm import synthesize_answer, synthesize_answer_streaming
 except ImportError:
-    from retriever import retrieve
+    from retriever import retrieve, encode_query
     from llm import synthesize_answer, synthesize_answer_streaming
 
 app = FastAPI(title="RAG Chatbot API", version="0.1.0")
@@ -27,6 +29,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger payloads (answers, sources) before they hit the wire
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
+
+@app.on_event("startup")
+async def preload_model():
+    """
+    Warm the query encoding path so the first request doesn't pay the load.
+    encode_query is what retrieve() actually calls, so this also triggers the
+    one-time ONNX export/quantization when that path is taken.
+    """
+    await asyncio.to_thread(encode_query, "warmup")
+
 
 class RetrieveRequest(BaseModel):
     query: str
@@ -62,8 +77,9 @@ async def retrieve_endpoint(request: RetrieveRequest):
     Retrieve top-k documents for a query.
     """
     try:
-        results = retrieve(request.query, top_k=request.top_k)
-        
+        # Retrieval is sync-blocking; keep it off the event loop thread
+        results = await asyncio.to_thread(retrieve, request.query, request.top_k)
+
         # Format results
         formatted_results = [
             {
@@ -88,9 +104,9 @@ async def chat_endpoint(request: ChatRequest):
     Chat endpoint that retrieves relevant chunks and generates an answer.
     """
     try:
-        # Retrieve relevant chunks
-        hits = retrieve(request.query, top_k=request.top_k)
-        
+        # Retrieve relevant chunks (off the event loop thread)
+        hits = await asyncio.to_thread(retrieve, request.query, request.top_k)
+
         if not hits:
             return ChatResponse(
                 answer="I couldn't find any relevant information to answer your query.",
@@ -98,8 +114,10 @@ async def chat_endpoint(request: ChatRequest):
                 llm_error=None
             )
         
-        # Synthesize answer
-        result = synthesize_answer(request.query, hits, use_llm=request.use_llm)
+        # Synthesize answer (LLM generation can block for seconds)
+        result = await asyncio.to_thread(
+            synthesize_answer, request.query, hits, request.use_llm
+        )
         
         return ChatResponse(
             answer=result["answer"],
@@ -119,9 +137,9 @@ async def chat_stream_endpoint(request: ChatRequest):
     """
     async def generate_stream() -> AsyncGenerator[str, None]:
         try:
-            # Retrieve relevant chunks
-            hits = retrieve(request.query, top_k=request.top_k)
-            
+            # Retrieve relevant chunks (off the event loop thread)
+            hits = await asyncio.to_thread(retrieve, request.query, request.top_k)
+
             if not hits:
                 # Send error message
                 yield f"data: {json.dumps({'type': 'error', 'content': 'No relevant information found'})}\n\n"
@@ -139,10 +157,7 @@ async def chat_stream_endpoint(request: ChatRequest):
                     yield f"data: {json.dumps({'type': 'error', 'content': chunk['content']})}\n\n"
                 elif chunk.get("type") == "done":
                     yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                
-                # Small delay to simulate real-time streaming
-                await asyncio.sleep(0.01)
-            
+
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
     
@@ -159,4 +174,23 @@ async def chat_stream_endpoint(request: ChatRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    # uvloop + httptools roughly double event-loop throughput; both ship with
+    # uvicorn[standard] but are unavailable on some platforms
+    run_kwargs = {}
+    try:
+        import uvloop  # noqa: F401
+        import httptools  # noqa: F401
+        run_kwargs.update(loop="uvloop", http="httptools")
+    except ImportError:
+        pass
+
+    # Each uvicorn worker is a spawned process with its own copy of the
+    # embedding model (and GGUF, with use_llm) — no fork/COW sharing — so
+    # default to one worker and let deployments with memory headroom opt in
+    workers = int(os.getenv("API_WORKERS", "1"))
+    if workers > 1:
+        # Multi-worker mode needs the import-string form
+        uvicorn.run("api:app", host="0.0.0.0", port=8000, workers=workers, **run_kwargs)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, **run_kwargs)
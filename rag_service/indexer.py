@@ -5,7 +5,25 @@ Loads chunk JSON files, creates embeddings, and stores in Chroma with persistenc
 
 import os
 import json
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+
+    def _text_hash(text: str) -> str:
+        return xxhash.xxh3_64_hexdigest(text.encode('utf-8'))
+except ImportError:
+    import hashlib
+
+    def _text_hash(text: str) -> str:
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
 from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb import PersistentClient
@@ -15,35 +33,94 @@ from chromadb.config import Settings
 CHUNKS_DIR = os.path.join(os.path.dirname(__file__), "..", "scraper", "chunks")
 CHROMA_DIR = os.path.join(os.path.dirname(__file__), "chroma_db")
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-BATCH_SIZE = 16
+BATCH_SIZE = 64
+ADD_BATCH_SIZE = 1024  # documents per collection.add call
 COLLECTION_NAME = "website_chunks"
 
+# Optional FAISS IVF-PQ backend: product-quantized codes are ~32x smaller
+# than float32 HNSW vectors, so large corpora stay cache-resident.
+# Enabled with RAG_USE_FAISS=1; Chroma remains the default backend.
+USE_FAISS = os.getenv("RAG_USE_FAISS", "0") == "1"
+FAISS_DIR = os.path.join(os.path.dirname(__file__), "faiss_index")
+FAISS_INDEX_FILE = "index.faiss"
+FAISS_DOCS_FILE = "docs.jsonl"
+
 # Ensure chroma directory exists
 os.makedirs(CHROMA_DIR, exist_ok=True)
 
 
+def build_faiss_index(texts: List[str], metadatas: List[Dict], embeddings: np.ndarray):
+    """
+    Build an IVF-PQ FAISS index over the chunk embeddings, plus a docs.jsonl
+    sidecar mapping row ids to text/metadata for lookup at query time.
+    """
+    import faiss
+
+    n, dim = embeddings.shape
+    nlist = max(64, int(4 * np.sqrt(n)))
+    quantizer = faiss.IndexFlatIP(dim)
+    index = faiss.IndexIVFPQ(quantizer, dim, nlist, 48, 8)
+
+    embs = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index.train(embs)
+    index.add(embs)
+
+    os.makedirs(FAISS_DIR, exist_ok=True)
+    faiss.write_index(index, os.path.join(FAISS_DIR, FAISS_INDEX_FILE))
+
+    with open(os.path.join(FAISS_DIR, FAISS_DOCS_FILE), 'wb') as f:
+        for text, meta in zip(texts, metadatas):
+            row = {"text": text, "meta": meta}
+            if orjson is not None:
+                f.write(orjson.dumps(row) + b'\n')
+            else:
+                f.write(json.dumps(row, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    print(f"FAISS index written to {FAISS_DIR} ({n} vectors, nlist={nlist})")
+
+
+def _load_one(filepath: str) -> Optional[Dict]:
+    """Load a single chunk JSON file (orjson when available)."""
+    try:
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except Exception as e:
+        print(f"Error loading {filepath}: {e}")
+        return None
+
+
 def load_chunks() -> List[Dict]:
-    """Load all chunk JSON files from CHUNKS_DIR."""
+    """
+    Load chunks from CHUNKS_DIR.
+    Prefers the single chunks.jsonl shard (one sequential read); falls back
+    to the legacy one-JSON-file-per-chunk layout with parallel reads.
+    """
     if not os.path.exists(CHUNKS_DIR):
         print(f"Error: Chunks directory {CHUNKS_DIR} does not exist")
         return []
-    
+
+    jsonl_path = os.path.join(CHUNKS_DIR, "chunks.jsonl")
+    if os.path.exists(jsonl_path):
+        try:
+            loads = orjson.loads if orjson is not None else json.loads
+            with open(jsonl_path, 'rb') as f:
+                chunks = [loads(line) for line in f if line.strip()]
+            print(f"Loaded {len(chunks)} chunks from {jsonl_path}")
+            return chunks
+        except Exception as e:
+            print(f"Error loading {jsonl_path}: {e}")
+
     json_files = [f for f in os.listdir(CHUNKS_DIR) if f.endswith('.json')]
-    
+
     if not json_files:
         print(f"No chunk JSON files found in {CHUNKS_DIR}")
         return []
-    
-    chunks = []
-    for filename in json_files:
-        filepath = os.path.join(CHUNKS_DIR, filename)
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                chunk_data = json.load(f)
-                chunks.append(chunk_data)
-        except Exception as e:
-            print(f"Error loading {filepath}: {e}")
-    
+
+    filepaths = [os.path.join(CHUNKS_DIR, f) for f in json_files]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        chunks = [c for c in executor.map(_load_one, filepaths) if c is not None]
+
     print(f"Loaded {len(chunks)} chunks from {CHUNKS_DIR}")
     return chunks
 
@@ -53,48 +130,100 @@ def index_chunks(chunks: List[Dict], model: SentenceTransformer, client: chromad
     Index chunks into Chroma collection.
     Creates embeddings in batches and adds to collection.
     """
+    # Inner-product space: with unit-normalized embeddings the dot product IS
+    # cosine similarity, and HNSW skips the L2 subtraction per distance eval
     collection = client.get_or_create_collection(
         name=COLLECTION_NAME,
-        metadata={"description": "Website content chunks"}
+        metadata={"description": "Website content chunks", "hnsw:space": "ip"}
     )
-    
+
+    # Incremental indexing: skip chunks whose id is already present with
+    # unchanged text (text_hash stored in metadata detects edits)
+    existing = collection.get(include=["metadatas"])
+    existing_hashes = {
+        chunk_id: (meta or {}).get("text_hash", "")
+        for chunk_id, meta in zip(existing["ids"], existing["metadatas"] or [])
+    }
+
+    text_hashes = [_text_hash(chunk["text"]) for chunk in chunks]
+    new_idx = [
+        i for i, chunk in enumerate(chunks)
+        if existing_hashes.get(chunk["chunk_id"]) != text_hashes[i]
+    ]
+
+    skipped = len(chunks) - len(new_idx)
+    if skipped:
+        print(f"Skipping {skipped} already-indexed chunks ({len(new_idx)} new or changed)")
+    if not new_idx:
+        count = collection.count()
+        print(f"Collection '{COLLECTION_NAME}' is up to date with {count} items")
+        return count
+
+    chunks = [chunks[i] for i in new_idx]
+    text_hashes = [text_hashes[i] for i in new_idx]
+
     # Prepare data
     texts = [chunk["text"] for chunk in chunks]
     ids = [chunk["chunk_id"] for chunk in chunks]
     metadatas = []
-    for chunk in chunks:
+    for chunk, text_hash in zip(chunks, text_hashes):
         clean_meta = {
             "url": str(chunk.get("url", "")),
             "title": str(chunk.get("title", "")),
             "chunk_id": str(chunk.get("chunk_id", "")),  # MUST be string
-            "source_file": str(chunk.get("source_file", ""))  # MUST be string
+            "source_file": str(chunk.get("source_file", "")),  # MUST be string
+            "text_hash": text_hash
         }
 
         # remove any internal fields like _type
         clean_meta = {k: v for k, v in clean_meta.items() if not k.startswith("_")}
-        
+
         metadatas.append(clean_meta)
 
     print(f"Creating embeddings with model {MODEL_NAME} (batch_size={BATCH_SIZE})...")
-    
-    # Create embeddings in batches
-    all_embeddings = []
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch_texts = texts[i:i + BATCH_SIZE]
-        batch_embeddings = model.encode(batch_texts, show_progress_bar=False)
-        all_embeddings.extend(batch_embeddings.tolist())
-        print(f"Processed batch {i // BATCH_SIZE + 1}/{(len(texts) + BATCH_SIZE - 1) // BATCH_SIZE}")
-    
-    print(f"Adding {len(ids)} documents to Chroma collection...")
-    
-    # Add to collection
-    collection.add(
-        ids=ids,
-        documents=texts,
-        metadatas=metadatas,
-        embeddings=all_embeddings
+
+    # Smart batching: encode texts sorted by length so each batch pads to
+    # similar-length neighbors instead of the longest chunk in input order,
+    # then restore the original order afterwards.
+    order = np.argsort([len(t) for t in texts])
+    texts_sorted = [texts[i] for i in order]
+    embeddings_sorted = model.encode(
+        texts_sorted,
+        batch_size=BATCH_SIZE,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True
     )
-    
+    inverse_order = np.argsort(order)
+    embeddings_array = np.ascontiguousarray(embeddings_sorted[inverse_order], dtype=np.float32)
+
+    print(f"Adding {len(ids)} documents to Chroma collection...")
+
+    # Upsert to collection (changed chunks replace their old rows). Chroma
+    # accepts float32 ndarrays directly, so the embeddings never round-trip
+    # through Python floats; slicing keeps each SQLite transaction modest.
+    for i in range(0, len(ids), ADD_BATCH_SIZE):
+        collection.upsert(
+            ids=ids[i:i + ADD_BATCH_SIZE],
+            documents=texts[i:i + ADD_BATCH_SIZE],
+            metadatas=metadatas[i:i + ADD_BATCH_SIZE],
+            embeddings=embeddings_array[i:i + ADD_BATCH_SIZE]
+        )
+
+    if USE_FAISS:
+        # build_faiss_index overwrites the index wholesale, and on an
+        # incremental run this batch holds only the new/changed chunks, so
+        # rebuild from the full upserted collection rather than the batch
+        try:
+            full = collection.get(include=["documents", "metadatas", "embeddings"])
+            build_faiss_index(
+                full["documents"],
+                full["metadatas"],
+                np.ascontiguousarray(full["embeddings"], dtype=np.float32)
+            )
+        except Exception as e:
+            print(f"Warning: FAISS index build failed, Chroma remains the backend: {e}")
+
     # Persist
     print(f"Data successfully added to Chroma collection and persisted.")
 
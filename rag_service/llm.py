@@ -1,22 +1,67 @@
 
 
-import os
-from typing import List, Dict, AsyncGenerator
 import asyncio
+import os
+import re
+import threading
+from typing import List, Dict, AsyncGenerator, Optional
+
+try:
+    import xxhash
+    _fingerprint = xxhash.xxh64_intdigest
+except ImportError:
+    _fingerprint = hash  # stdlib fallback, still an 8-byte integer fingerprint
 
 GPT4ALL_MODEL_PATH = os.getenv("GPT4ALL_MODEL", "")
 
+# Words per streamed SSE token event; batching cuts framing overhead
+TOKEN_BATCH_WORDS = 8
+
+# Per-hit character cap for the prompt context; longer snippets mostly grow
+# LLM prefill cost without improving the answer
+CONTEXT_CHARS_PER_HIT = 1200
+
+# Process-wide GPT4All instance: loading the GGUF takes seconds and gigabytes,
+# so it must happen once, not per request
+_gpt4all_model = None
+_gpt4all_lock = threading.Lock()
+
+# The shared instance is one llama.cpp context: interleaved generate() calls
+# corrupt each other's output, so generation itself is serialized too (held
+# for the whole call/stream, always from a worker thread)
+_gpt4all_gen_lock = threading.Lock()
+
+
+def _get_gpt4all():
+    """Load the GPT4All model once per process and reuse it."""
+    global _gpt4all_model
+    if _gpt4all_model is None:
+        with _gpt4all_lock:
+            if _gpt4all_model is None:
+                from gpt4all import GPT4All
+                _gpt4all_model = GPT4All(GPT4ALL_MODEL_PATH, n_threads=os.cpu_count())
+    return _gpt4all_model
+
+
+
+# Split on sentence-final punctuation instead of bare "." so decimals
+# and URLs survive intact
+_SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
 
 
 def remove_duplicate_sentences(text: str) -> str:
-    seen = set()
+    seen_fp = set()
     unique = []
-    for sentence in text.split("."):
+    for sentence in _SENT_SPLIT.split(text):
         s = sentence.strip()
-        if s and s not in seen:
-            seen.add(s)
+        if not s:
+            continue
+        # Integer fingerprints make the seen-set compares 8-byte ops
+        fp = _fingerprint(s.lower().encode('utf-8'))
+        if fp not in seen_fp:
+            seen_fp.add(fp)
             unique.append(s)
-    return ". ".join(unique)
+    return " ".join(unique)
 
 def generate_with_gpt4all(prompt: str, max_tokens: int = 200) -> str:
     if not GPT4ALL_MODEL_PATH:
@@ -24,9 +69,9 @@ def generate_with_gpt4all(prompt: str, max_tokens: int = 200) -> str:
     if not os.path.exists(GPT4ALL_MODEL_PATH):
         raise Exception(f"GPT4All model file not found: {GPT4ALL_MODEL_PATH}")
     try:
-        from gpt4all import GPT4All
-        model = GPT4All(GPT4ALL_MODEL_PATH)
-        response = model.generate(prompt, max_tokens=max_tokens, temp=0.7)
+        model = _get_gpt4all()
+        with _gpt4all_gen_lock:
+            response = model.generate(prompt, max_tokens=max_tokens, temp=0.7)
         return response.strip()
     except ImportError:
         raise Exception("gpt4all package not installed. Install with: pip install gpt4all")
@@ -38,8 +83,12 @@ def synthesize_answer(query: str, hits: List[Dict], use_llm: bool = False) -> Di
         return {"answer": "I couldn't find any relevant information to answer your query.", "sources": []}
     if use_llm:
         try:
-            context = "\n\n".join([f"Source {i+1} (from {hit['meta'].get('url', 'unknown')}):\n{hit['text']}" for i, hit in enumerate(hits[:3])])
-            prompt = f"""Based on the following context, answer the question. If the answer is not in the context, say so.\n\nContext:\n{context}\n\nQuestion: {query}\n\nAnswer:"""
+            parts = []
+            append = parts.append
+            for i, hit in enumerate(hits[:3]):
+                append(f"Source {i+1} (from {hit['meta'].get('url', 'unknown')}):\n{hit['text'][:CONTEXT_CHARS_PER_HIT]}\n\n")
+            context = ''.join(parts)
+            prompt = f"""Based on the following context, answer the question. If the answer is not in the context, say so.\n\nContext:\n{context}\nQuestion: {query}\n\nAnswer:"""
             answer = generate_with_gpt4all(prompt, max_tokens=300)
             sources = [hit['meta'] for hit in hits]
             return {"answer": answer, "sources": sources}
@@ -70,10 +119,12 @@ def _generate_fallback_answer(query: str, hits: List[Dict]) -> Dict:
 
 async def synthesize_answer_streaming(query: str, hits: List[Dict], use_llm: bool = False):
     """
-    Final version that bypasses the library's streaming bug.
-    It generates the full response first, then streams it word by word.
+    Stream answer tokens as GPT4All produces them, so the first token
+    arrives after prompt prefill instead of after the full generation.
+    Falls back to a word-batched stream of the extractive answer when the
+    LLM is unavailable.
     """
-    print("\n--- Starting FINAL synthesize_answer_streaming ---")
+    print("\n--- Starting synthesize_answer_streaming ---")
     print(f"Query: '{query}'")
     print(f"Use LLM requested: {use_llm}")
 
@@ -87,31 +138,35 @@ async def synthesize_answer_streaming(query: str, hits: List[Dict], use_llm: boo
             if not GPT4ALL_MODEL_PATH or not os.path.exists(GPT4ALL_MODEL_PATH):
                 raise FileNotFoundError("GPT4ALL_MODEL path is not set or file not found.")
 
-            from gpt4all import GPT4All
-            model = GPT4All(GPT4ALL_MODEL_PATH)
+            model = _get_gpt4all()
             print("   -> Model loaded.")
 
             context = hits[0]['text']
             prompt = f"Using the following text, answer the user's question.\n\nText: {context}\n\nQuestion: {query}\n\nAnswer:"
-            print(f"[STEP 2] Generating full response (non-streaming)...")
-
-         
-            full_response = model.generate(prompt, max_tokens=350, temp=0.7, streaming=False)
-
-            if not full_response.strip():
+            print("[STEP 2] Streaming tokens as they are generated...")
+
+            # Hold the generation lock for the whole stream (acquired in a
+            # worker thread, never on the event loop) so a concurrent
+            # request can't interleave tokens on the shared context
+            await asyncio.to_thread(_gpt4all_gen_lock.acquire)
+            try:
+                # model.generate's iterator blocks in C between tokens; pull
+                # each token through a worker thread so the event loop keeps
+                # serving other requests while this answer generates
+                token_iter = iter(model.generate(prompt, max_tokens=350, temp=0.7, streaming=True))
+                produced_any = False
+                while True:
+                    token = await asyncio.to_thread(next, token_iter, None)
+                    if token is None:
+                        break
+                    produced_any = True
+                    yield {"type": "token", "content": token}
+            finally:
+                _gpt4all_gen_lock.release()
+
+            if not produced_any:
                 raise RuntimeError("LLM generated an empty response.")
 
-            print(f"[SUCCESS] LLM generated a full response: '{full_response[:100]}...'")
-            
-            print("[STEP 3] Now streaming the generated response word by word...")
-            
-            words = full_response.split()
-            for word in words:
-                print(f"Streaming word: '{word}'") 
-                yield {"type": "token", "content": word + " "}
-                await asyncio.sleep(0.01) 
-
-            
             yield {"type": "done"}
             return
 
@@ -125,8 +180,8 @@ async def synthesize_answer_streaming(query: str, hits: List[Dict], use_llm: boo
     answer_text = fallback_result["answer"]
     
     words = answer_text.split()
-    for word in words:
-        yield {"type": "token", "content": word + " "}
-    
+    for i in range(0, len(words), TOKEN_BATCH_WORDS):
+        yield {"type": "token", "content": " ".join(words[i:i + TOKEN_BATCH_WORDS]) + " "}
+
     yield {"type": "done"}
     print("--- Stream finished using fallback. ---")
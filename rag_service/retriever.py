@@ -4,7 +4,11 @@ Encodes queries and retrieves top-k similar chunks.
 """
 
 import os
-from typing import List, Dict, Optional
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb.config import Settings
@@ -13,10 +17,124 @@ from chromadb.config import Settings
 CHROMA_DIR = os.path.join(os.path.dirname(__file__), "chroma_db")
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 COLLECTION_NAME = "website_chunks"
+EMBEDDING_DIM = 384
+
+# Cache configuration
+EXACT_CACHE_SIZE = 512
+SEM_CACHE_SIZE = 256
+SEM_CACHE_THRESHOLD = 0.97
+
+# ONNX fast path: int8-quantized MiniLM served via onnxruntime (exported once,
+# cached on disk). Falls back to the PyTorch SentenceTransformer if unavailable.
+ONNX_DIR = os.path.join(os.path.dirname(__file__), "onnx_model")
+ONNX_MODEL_FILE = "model_quantized.onnx"
 
 # Global model and client (lazy loaded)
 _model: Optional[SentenceTransformer] = None
 _client: Optional[chromadb.ClientAPI] = None
+_ort_session = None
+_tokenizer = None
+_onnx_failed = False
+
+# Collection size, cached to avoid a count() round trip on every query;
+# invalidated whenever a retrieve fails
+_collection_count: Optional[int] = None
+
+# Optional FAISS IVF-PQ backend (built by indexer.py with RAG_USE_FAISS=1)
+USE_FAISS = os.getenv("RAG_USE_FAISS", "0") == "1"
+FAISS_DIR = os.path.join(os.path.dirname(__file__), "faiss_index")
+FAISS_NPROBE = 8
+_faiss_index = None
+_faiss_docs: Optional[List[Dict]] = None
+
+
+def _faiss_search(q_vec: np.ndarray, top_k: int) -> Optional[List[Dict]]:
+    """
+    Search the FAISS IVF-PQ index if one exists.
+    Returns hits, or None when the index is unavailable (caller falls back
+    to Chroma).
+    """
+    global _faiss_index, _faiss_docs
+    if _faiss_index is None:
+        index_path = os.path.join(FAISS_DIR, "index.faiss")
+        docs_path = os.path.join(FAISS_DIR, "docs.jsonl")
+        if not (os.path.exists(index_path) and os.path.exists(docs_path)):
+            return None
+        try:
+            import faiss
+            _faiss_index = faiss.read_index(index_path)
+            _faiss_index.nprobe = FAISS_NPROBE
+            with open(docs_path, 'rb') as f:
+                _faiss_docs = [json.loads(line) for line in f]
+        except Exception as e:
+            print(f"Warning: FAISS index unavailable, falling back to Chroma: {e}")
+            return None
+
+    scores, row_ids = _faiss_index.search(
+        np.ascontiguousarray(q_vec[None, :], dtype=np.float32), top_k
+    )
+    return [
+        {"text": _faiss_docs[i]["text"], "meta": _faiss_docs[i]["meta"], "score": float(s)}
+        for s, i in zip(scores[0], row_ids[0]) if i >= 0
+    ]
+
+# Two-tier query cache:
+# - exact cache: (query, top_k) -> hits, FIFO-evicted dict for identical queries
+# - semantic cache: ring buffer of normalized query embeddings + payloads;
+#   an incoming query whose cosine similarity to a cached query exceeds
+#   SEM_CACHE_THRESHOLD reuses the cached hits without touching Chroma
+_exact_cache: "OrderedDict[Tuple[str, int], List[Dict]]" = OrderedDict()
+_sem_embeddings = np.zeros((SEM_CACHE_SIZE, EMBEDDING_DIM), dtype=np.float32)
+_sem_payloads: List[Tuple[int, List[Dict]]] = []
+_sem_next = 0
+
+# retrieve() runs on asyncio worker threads, so the semantic tier's
+# row-claim + matrix write must not interleave between requests; the GEMV
+# is cheap enough to sit under the same lock
+_cache_lock = threading.Lock()
+
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    """Return a unit-norm float32 copy of vec (so similarity is a dot product)."""
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec = vec / norm
+    return vec
+
+
+def _semantic_cache_lookup(q_vec: np.ndarray, top_k: int) -> Optional[List[Dict]]:
+    """Return cached hits if a near-duplicate query (same top_k) is cached."""
+    with _cache_lock:
+        if not _sem_payloads:
+            return None
+        sims = _sem_embeddings[:len(_sem_payloads)] @ q_vec  # single GEMV
+        best = int(np.argmax(sims))
+        if sims[best] >= SEM_CACHE_THRESHOLD and _sem_payloads[best][0] == top_k:
+            return _sem_payloads[best][1]
+    return None
+
+
+def _exact_cache_put(key: Tuple[str, int], hits: List[Dict]):
+    """Insert into the exact cache, evicting FIFO past EXACT_CACHE_SIZE."""
+    _exact_cache[key] = hits
+    if len(_exact_cache) > EXACT_CACHE_SIZE:
+        _exact_cache.popitem(last=False)
+
+
+def _cache_store(query: str, top_k: int, q_vec: np.ndarray, hits: List[Dict]):
+    """Record a retrieval result in both cache tiers."""
+    global _sem_next
+    with _cache_lock:
+        _exact_cache_put((query, top_k), hits)
+        if len(_sem_payloads) < SEM_CACHE_SIZE:
+            _sem_embeddings[len(_sem_payloads)] = q_vec
+            _sem_payloads.append((top_k, hits))
+        else:
+            # Full: overwrite oldest row in place to avoid reallocating the matrix
+            _sem_embeddings[_sem_next] = q_vec
+            _sem_payloads[_sem_next] = (top_k, hits)
+            _sem_next = (_sem_next + 1) % SEM_CACHE_SIZE
 
 
 def get_model() -> SentenceTransformer:
@@ -27,6 +145,62 @@ def get_model() -> SentenceTransformer:
     return _model
 
 
+def _export_onnx_model():
+    """Export MiniLM to ONNX and int8-quantize it (one-time, cached in ONNX_DIR)."""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(MODEL_NAME, export=True)
+    model.save_pretrained(ONNX_DIR)
+    quantizer = ORTQuantizer.from_pretrained(ONNX_DIR)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False)
+    quantizer.quantize(save_dir=ONNX_DIR, quantization_config=qconfig)
+
+
+def _get_ort_session():
+    """Lazy load the int8 ONNX session + tokenizer; None if the path is unavailable."""
+    global _ort_session, _tokenizer, _onnx_failed
+    if _ort_session is not None or _onnx_failed:
+        return _ort_session
+    try:
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(ONNX_DIR, ONNX_MODEL_FILE)
+        if not os.path.exists(model_path):
+            _export_onnx_model()
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = os.cpu_count()
+        _ort_session = ort.InferenceSession(model_path, sess_options)
+        _tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
+    except Exception as e:
+        print(f"Warning: ONNX embedding path unavailable, using SentenceTransformer: {e}")
+        _onnx_failed = True
+    return _ort_session
+
+
+def encode_query(text: str) -> np.ndarray:
+    """
+    Encode text to a (384,) float32 embedding.
+    Prefers the int8 ONNX Runtime session; falls back to SentenceTransformer.
+    """
+    session = _get_ort_session()
+    if session is None:
+        return np.asarray(
+            get_model().encode(text, show_progress_bar=False, normalize_embeddings=True),
+            dtype=np.float32
+        )
+
+    encoded = _tokenizer(text, truncation=True, return_tensors="np")
+    feed = {inp.name: encoded[inp.name].astype(np.int64) for inp in session.get_inputs()}
+    token_embeddings = session.run(None, feed)[0][0]  # (seq_len, 384)
+    # Mean-pool over the attention mask, then L2-normalize
+    mask = encoded["attention_mask"][0].astype(np.float32)[:, None]
+    pooled = (token_embeddings * mask).sum(axis=0) / max(float(mask.sum()), 1e-9)
+    return _normalize(pooled)
+
+
 def get_client() -> chromadb.ClientAPI:
     """Lazy load Chroma client."""
     global _client
@@ -50,40 +224,66 @@ def retrieve(query: str, top_k: int = 5) -> List[Dict]:
         List of dictionaries with keys: text, meta, score
     """
     try:
-        model = get_model()
+        # Exact cache: identical (query, top_k) collapses to a dict lookup
+        cache_key = (query, top_k)
+        if cache_key in _exact_cache:
+            return _exact_cache[cache_key]
+
+        # Encode query once; reused for the semantic cache and the index query
+        query_embedding = encode_query(query)
+        q_vec = _normalize(query_embedding)
+
+        # Semantic cache: near-duplicate queries reuse cached hits
+        cached = _semantic_cache_lookup(q_vec, top_k)
+        if cached is not None:
+            _exact_cache_put(cache_key, cached)
+            return cached
+
+        # Optional FAISS backend (falls through to Chroma when absent)
+        if USE_FAISS:
+            hits = _faiss_search(q_vec, top_k)
+            if hits is not None:
+                _cache_store(query, top_k, q_vec, hits)
+                return hits
+
         client = get_client()
-        
+
         # Get collection
         try:
             collection = client.get_collection(name=COLLECTION_NAME)
         except Exception as e:
             print(f"Error getting collection: {e}")
             return []
-        
-        # Encode query
-        query_embedding = model.encode(query, show_progress_bar=False).tolist()
-        
-        # Query collection
+
+        # Query collection (count is cached; Chroma errors if n_results > count)
+        global _collection_count
+        if _collection_count is None:
+            _collection_count = collection.count()
+
         results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=min(top_k, collection.count())
+            query_embeddings=[query_embedding.tolist()],
+            n_results=min(top_k, _collection_count)
         )
-        
+
         # Format results
         hits = []
         if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                hit = {
-                    "text": results['documents'][0][i],
-                    "meta": results['metadatas'][0][i],
-                    "score": 1.0 - results['distances'][0][i]  # Convert distance to similarity
-                }
-                hits.append(hit)
-        
+            docs = results['documents'][0]
+            metas = results['metadatas'][0]
+            # Chroma's ip distance is 1 - dot, so on unit vectors this is
+            # exact cosine similarity
+            scores = 1.0 - np.asarray(results['distances'][0])
+            hits = [
+                {"text": doc, "meta": meta, "score": float(score)}
+                for doc, meta, score in zip(docs, metas, scores)
+            ]
+
+        _cache_store(query, top_k, q_vec, hits)
         return hits
-    
+
     except Exception as e:
         print(f"Error in retrieve: {e}")
+        _collection_count = None  # refresh the cached count on next call
         return []
 
 
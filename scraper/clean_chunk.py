@@ -6,9 +6,16 @@ Reads scraped JSON files, cleans text, and chunks into ~300-word chunks with ove
 import os
 import json
 import re
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict
+import numpy as np
 import nltk
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Try to download punkt tokenizer, fallback to simple word split if fails
 try:
     nltk.data.find('tokenizers/punkt')
@@ -20,6 +27,7 @@ except LookupError:
 
 INPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "chunks")
+CHUNKS_FILE = os.path.join(OUTPUT_DIR, "chunks.jsonl")
 
 # Configuration
 CHUNK_SIZE_WORDS = 300
@@ -29,14 +37,21 @@ CHUNK_OVERLAP_WORDS = 50
 os.makedirs(INPUT_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Whitespace collapsing runs over every scraped page; compile the pattern once
+# at import and prefer google-re2 (linear-time DFA) when installed, which scans
+# large pages in a single pass instead of backtracking.
+try:
+    import re2 as _re_impl
+except ImportError:
+    _re_impl = re
+
+_WS_RE = _re_impl.compile(r'\s+')
+_WORD_RE = _re_impl.compile(r'\S+')
+
 
 def clean_text(text: str) -> str:
     """Clean text: strip blank lines, collapse whitespace."""
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    # Remove leading/trailing whitespace
-    text = text.strip()
-    return text
+    return _WS_RE.sub(' ', text).strip()
 
 
 def word_count(text: str) -> int:
@@ -47,33 +62,37 @@ def word_count(text: str) -> int:
 def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
     """
     Split text into chunks of approximately chunk_size words with overlap.
-    Uses simple word splitting (fallback if NLTK unavailable).
+    Chunks are sliced directly out of the original string via precomputed
+    word offsets, so overlapping windows never re-materialize their words.
     """
-    words = text.split()
-    chunks = []
-    
-    if len(words) <= chunk_size:
+    spans = [m.span() for m in _WORD_RE.finditer(text)]
+    n_words = len(spans)
+
+    if n_words <= chunk_size:
         return [text]
-    
+
+    starts = np.fromiter((s for s, _ in spans), dtype=np.int64, count=n_words)
+    ends = np.fromiter((e for _, e in spans), dtype=np.int64, count=n_words)
+
+    chunks = []
     start = 0
-    while start < len(words):
-        end = start + chunk_size
-        chunk_words = words[start:end]
-        chunk_text = ' '.join(chunk_words)
-        chunks.append(chunk_text)
-        
+    while start < n_words:
+        end = min(start + chunk_size, n_words)
+        chunks.append(text[starts[start]:ends[end - 1]])
+
         # Move start forward by (chunk_size - overlap)
         start += (chunk_size - overlap)
-    
+
     return chunks
 
 
 def process_file(filepath: str) -> List[Dict]:
     """Process a single JSON file and return list of chunk dictionaries."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+
         url = data.get("url", "")
         title = data.get("title", "Untitled")
         #text = data.get("text", "")
@@ -109,37 +128,45 @@ def process_file(filepath: str) -> List[Dict]:
         return []
 
 
+def write_chunks(chunks: List[Dict]):
+    """
+    Write all chunks as one line-delimited JSON shard.
+    A single sequential write replaces one file (and its syscalls/inode)
+    per chunk, which dominated the old layout at >10k chunks.
+    """
+    with open(CHUNKS_FILE, 'wb') as f:
+        for chunk in chunks:
+            if orjson is not None:
+                f.write(orjson.dumps(chunk) + b'\n')
+            else:
+                f.write(json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
 def process_all_files() -> int:
     """Process all JSON files in INPUT_DIR and save chunks to OUTPUT_DIR."""
     if not os.path.exists(INPUT_DIR):
         print(f"Error: Input directory {INPUT_DIR} does not exist")
         return 0
-    
+
     json_files = [f for f in os.listdir(INPUT_DIR) if f.endswith('.json')]
-    
+
     if not json_files:
         print(f"No JSON files found in {INPUT_DIR}")
         return 0
-    
+
     print(f"Processing {len(json_files)} files from {INPUT_DIR}")
-    
-    total_chunks = 0
-    
-    for filename in json_files:
-        filepath = os.path.join(INPUT_DIR, filename)
-        chunks = process_file(filepath)
-        
-        # Save each chunk as separate JSON file
-        for chunk in chunks:
-            chunk_filename = f"{chunk['chunk_id']}.json"
-            chunk_filepath = os.path.join(OUTPUT_DIR, chunk_filename)
-            
-            with open(chunk_filepath, 'w', encoding='utf-8') as f:
-                json.dump(chunk, f, ensure_ascii=False, indent=2)
-            
-            total_chunks += 1
-    
-    print(f"\nChunking completed. Created {total_chunks} chunks in {OUTPUT_DIR}")
+
+    filepaths = [os.path.join(INPUT_DIR, f) for f in json_files]
+
+    # Clean/chunk files across all cores (process_file is CPU-bound regex work)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = list(executor.map(process_file, filepaths))
+
+    all_chunks = [chunk for chunks in results for chunk in chunks]
+    write_chunks(all_chunks)
+
+    total_chunks = len(all_chunks)
+    print(f"\nChunking completed. Wrote {total_chunks} chunks to {CHUNKS_FILE}")
     return total_chunks
 
 
@@ -1,24 +1,45 @@
 """
-BFS Web Crawler with robots.txt respect and rate limiting.
+Concurrent BFS Web Crawler with robots.txt respect and rate limiting.
 Scrapes a website, extracts main content using readability, and saves as JSON.
 """
 
 import os
 import json
 import time
+import asyncio
 import hashlib
 import urllib.robotparser
 import urllib.parse
-from collections import deque
-from typing import Set, Dict, Optional
+from typing import List, Dict, Optional
+import aiohttp
 import requests
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    from pybloom_live import ScalableBloomFilter
+except ImportError:
+    ScalableBloomFilter = None
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from readability import Document
 from bs4 import BeautifulSoup
 
+# selectolax (C-based Modest engine) parses HTML far faster than
+# BeautifulSoup + html.parser; fall back to BS4 when not installed
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
 # Configuration
 ROOT_URL = os.getenv("ROOT_URL", "https://quotes.toscrape.com/")
 MAX_PAGES = int(os.getenv("MAX_PAGES", "200"))
 RATE_LIMIT = float(os.getenv("RATE", "1.0"))  # seconds between requests
+CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))  # concurrent fetch workers
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
 USER_AGENT = "RAG-Crawler/1.0"
 
@@ -26,38 +47,86 @@ USER_AGENT = "RAG-Crawler/1.0"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
-def get_robots_parser(url: str) -> Optional[urllib.robotparser.RobotFileParser]:
+def make_session() -> requests.Session:
+    """Build a keep-alive session so same-origin requests reuse one TCP/TLS connection."""
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_robots_parser(url: str, session: Optional[requests.Session] = None) -> Optional[urllib.robotparser.RobotFileParser]:
     """Parse robots.txt for the given URL."""
     parsed = urllib.parse.urlparse(url)
     robots_url = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
     rp = urllib.robotparser.RobotFileParser()
     try:
-        rp.set_url(robots_url)
-        rp.read()
+        if session is not None:
+            response = session.get(robots_url, timeout=10)
+            response.raise_for_status()
+            rp.parse(response.text.splitlines())
+        else:
+            rp.set_url(robots_url)
+            rp.read()
         return rp
     except Exception as e:
         print(f"Warning: Could not fetch robots.txt from {robots_url}: {e}")
         return None
 
 
+# Query parameters that never change page content; stripping them shrinks
+# the URL space the visited set has to track
+TRACKING_PARAMS = frozenset({
+    "utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content",
+    "fbclid", "gclid"
+})
+
+
+def _make_seen_set():
+    """
+    Membership tracker for visited URLs / content checksums.
+    Uses a scalable Bloom filter when pybloom_live is installed (bounded
+    memory, tiny false-positive rate), else a plain set.
+    """
+    if ScalableBloomFilter is not None:
+        return ScalableBloomFilter(initial_capacity=10_000, error_rate=1e-5)
+    return set()
+
+
 def get_canonical_url(url: str) -> str:
-    """Normalize URL to canonical form (remove fragments, normalize path)."""
+    """Normalize URL to canonical form (lowercase host, strip fragment and tracking params)."""
     parsed = urllib.parse.urlparse(url)
-    # Remove fragment, normalize path
+    query = urllib.parse.urlencode([
+        (k, v) for k, v in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS
+    ])
     normalized = urllib.parse.urlunparse((
-        parsed.scheme,
-        parsed.netloc,
+        parsed.scheme.lower(),
+        parsed.netloc.lower(),
         parsed.path.rstrip('/') or '/',
         parsed.params,
-        parsed.query,
+        query,
         ''  # no fragment
     ))
     return normalized
 
 
 def calculate_checksum(text: str) -> str:
-    """Calculate MD5 checksum of text for deduplication."""
-    return hashlib.md5(text.encode('utf-8')).hexdigest()
+    """
+    Calculate checksum of text for deduplication.
+    Dedup needs no cryptographic strength, so prefer xxh3 (SIMD, ~30x the
+    throughput of MD5); fall back to MD5 when xxhash is not installed.
+    """
+    data = text.encode('utf-8')
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(data)
+    return hashlib.md5(data).hexdigest()
 
 
 def extract_content(url: str, html: str) -> Dict:
@@ -66,11 +135,14 @@ def extract_content(url: str, html: str) -> Dict:
         doc = Document(html)
         title = doc.title()
         content = doc.summary()
-        
+
         # Clean HTML tags from content
-        soup = BeautifulSoup(content, 'html.parser')
-        text = soup.get_text(separator=' ', strip=True)
-        
+        if HTMLParser is not None:
+            text = HTMLParser(content).text(separator=' ', strip=True)
+        else:
+            soup = BeautifulSoup(content, 'html.parser')
+            text = soup.get_text(separator=' ', strip=True)
+
         return {
             "url": url,
             "title": title or "Untitled",
@@ -87,100 +159,143 @@ def extract_content(url: str, html: str) -> Dict:
         }
 
 
-def crawl_website(root_url: str, max_pages: int, rate_limit: float) -> int:
+def extract_links(base_url: str, html: str, root_netloc: str) -> List[str]:
+    """Extract same-domain canonical links from a page."""
+    links = []
+    try:
+        if HTMLParser is not None:
+            hrefs = [n.attributes.get('href') for n in HTMLParser(html).css('a[href]')]
+        else:
+            soup = BeautifulSoup(html, 'html.parser')
+            hrefs = [link['href'] for link in soup.find_all('a', href=True)]
+        for href in hrefs:
+            if not href:
+                continue
+            absolute_url = urllib.parse.urljoin(base_url, href)
+            # Only follow same-domain links
+            if urllib.parse.urlparse(absolute_url).netloc == root_netloc:
+                links.append(get_canonical_url(absolute_url))
+    except Exception as e:
+        print(f"Warning: Error extracting links from {base_url}: {e}")
+    return links
+
+
+def save_page(page_data: Dict, filepath: str):
+    """Write one page's extracted content to a JSON file."""
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(page_data, f, ensure_ascii=False, indent=2)
+
+
+async def crawl_website(root_url: str, max_pages: int, rate_limit: float) -> int:
     """
-    BFS crawl starting from root_url.
+    Concurrent BFS crawl starting from root_url.
+    Workers overlap HTTP fetches while a shared rate slot keeps the crawl
+    polite (at most one request started per rate_limit seconds).
     Returns number of pages saved.
     """
-    visited: Set[str] = set()
-    checksums: Set[str] = set()
-    queue = deque([root_url])
+    visited = _make_seen_set()
+    checksums = _make_seen_set()
+    queue: asyncio.Queue = asyncio.Queue()
+    await queue.put(root_url)
     saved_count = 0
-    
-    # Get robots parser
-    robots_parser = get_robots_parser(root_url)
-    
+    next_slot = time.monotonic()
+    root_netloc = urllib.parse.urlparse(root_url).netloc
+    loop = asyncio.get_running_loop()
+
+    # Get robots parser (one-time fetch through a pooled sync session)
+    robots_parser = get_robots_parser(root_url, make_session())
+
     print(f"Starting crawl from {root_url}")
-    print(f"Max pages: {max_pages}, Rate limit: {rate_limit}s")
-    
-    while queue and saved_count < max_pages:
-        current_url = queue.popleft()
-        canonical = get_canonical_url(current_url)
-        
-        if canonical in visited:
-            continue
-        
-        # Check robots.txt
-        if robots_parser and not robots_parser.can_fetch(USER_AGENT, canonical):
-            print(f"Skipping {canonical} (disallowed by robots.txt)")
-            visited.add(canonical)
-            continue
-        
-        visited.add(canonical)
-        
-        # Rate limiting
-        time.sleep(rate_limit)
-        
-        try:
-            response = requests.get(
-                canonical,
-                headers={"User-Agent": USER_AGENT},
-                timeout=10,
-                allow_redirects=True
-            )
-            response.raise_for_status()
-            
-            # Extract content
-            page_data = extract_content(canonical, response.text)
-            checksum = calculate_checksum(page_data["text"])
-            
-            # Deduplicate by checksum
-            if checksum in checksums:
-                print(f"Skipping duplicate content: {canonical}")
-                continue
-            
-            checksums.add(checksum)
-            page_data["checksum"] = checksum
-            
-            # Save to JSON file
-            filename = f"{saved_count:05d}_{checksum[:8]}.json"
-            filepath = os.path.join(OUTPUT_DIR, filename)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(page_data, f, ensure_ascii=False, indent=2)
-            
-            saved_count += 1
-            print(f"[{saved_count}/{max_pages}] Saved: {canonical}")
-            
-            # Extract links for BFS (only if we haven't reached max)
-            if saved_count < max_pages:
+    print(f"Max pages: {max_pages}, Rate limit: {rate_limit}s, Workers: {CONCURRENCY}")
+
+    connector = aiohttp.TCPConnector(limit_per_host=4, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        headers={"User-Agent": USER_AGENT}
+    ) as session:
+
+        async def worker():
+            nonlocal saved_count, next_slot
+            while True:
+                current_url = await queue.get()
                 try:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    for link in soup.find_all('a', href=True):
-                        href = link['href']
-                        absolute_url = urllib.parse.urljoin(canonical, href)
-                        parsed = urllib.parse.urlparse(absolute_url)
-                        
-                        # Only follow same-domain links
-                        root_parsed = urllib.parse.urlparse(root_url)
-                        if parsed.netloc == root_parsed.netloc:
-                            abs_canonical = get_canonical_url(absolute_url)
-                            if abs_canonical not in visited:
-                                queue.append(abs_canonical)
+                    if saved_count >= max_pages:
+                        continue
+
+                    canonical = get_canonical_url(current_url)
+                    if canonical in visited:
+                        continue
+
+                    # Check robots.txt
+                    if robots_parser and not robots_parser.can_fetch(USER_AGENT, canonical):
+                        print(f"Skipping {canonical} (disallowed by robots.txt)")
+                        visited.add(canonical)
+                        continue
+
+                    visited.add(canonical)
+
+                    # Rate limiting: claim the next available fetch slot
+                    now = time.monotonic()
+                    slot = max(next_slot, now)
+                    next_slot = slot + rate_limit
+                    await asyncio.sleep(max(0.0, slot - now))
+
+                    try:
+                        async with session.get(canonical, timeout=timeout, allow_redirects=True) as response:
+                            response.raise_for_status()
+                            html = await response.text()
+                    except Exception as e:
+                        print(f"Error fetching {canonical}: {e}")
+                        continue
+
+                    # Extract content off the event loop (readability is CPU-bound)
+                    page_data = await loop.run_in_executor(None, extract_content, canonical, html)
+                    checksum = calculate_checksum(page_data["text"])
+
+                    # Deduplicate by checksum
+                    if checksum in checksums:
+                        print(f"Skipping duplicate content: {canonical}")
+                        continue
+
+                    if saved_count >= max_pages:
+                        continue
+
+                    checksums.add(checksum)
+                    page_data["checksum"] = checksum
+
+                    # Save to JSON file
+                    filename = f"{saved_count:05d}_{checksum[:8]}.json"
+                    filepath = os.path.join(OUTPUT_DIR, filename)
+                    saved_count += 1
+                    await loop.run_in_executor(None, save_page, page_data, filepath)
+
+                    print(f"[{saved_count}/{max_pages}] Saved: {canonical}")
+
+                    # Extract links for BFS (only if we haven't reached max)
+                    if saved_count < max_pages:
+                        links = await loop.run_in_executor(
+                            None, extract_links, canonical, html, root_netloc
+                        )
+                        for link in links:
+                            if link not in visited:
+                                await queue.put(link)
+
                 except Exception as e:
-                    print(f"Warning: Error extracting links from {canonical}: {e}")
-        
-        except requests.RequestException as e:
-            print(f"Error fetching {canonical}: {e}")
-            continue
-        except Exception as e:
-            print(f"Unexpected error processing {canonical}: {e}")
-            continue
-    
+                    print(f"Unexpected error processing {current_url}: {e}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(CONCURRENCY)]
+        await queue.join()
+        for task in workers:
+            task.cancel()
+
     print(f"\nCrawl completed. Saved {saved_count} pages to {OUTPUT_DIR}")
     return saved_count
 
 
 if __name__ == "__main__":
-    saved = crawl_website(ROOT_URL, MAX_PAGES, RATE_LIMIT)
+    saved = asyncio.run(crawl_website(ROOT_URL, MAX_PAGES, RATE_LIMIT))
     print(f"Total pages saved: {saved}")
 